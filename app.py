@@ -7,13 +7,15 @@ Execute localmente com:
 
 from __future__ import annotations
 
-import csv
 import io
+import os
 import re
+import weakref
 import zipfile
 from dataclasses import dataclass
-from typing import Iterable, List, Tuple
+from typing import Any, Iterable, Iterator, List, Tuple
 
+import pandas as pd
 import streamlit as st
 from pypdf import PdfReader, PdfWriter
 from pypdf.generic import (
@@ -22,6 +24,7 @@ from pypdf.generic import (
     DictionaryObject,
     IndirectObject,
     NameObject,
+    StreamObject,
 )
 
 LOGIN_PATTERN = re.compile(
@@ -34,6 +37,27 @@ PASSWORD_PATTERN = re.compile(
     re.S,
 )
 
+LOGIN_ANCHOR = (b"/C2_1 11.22 Tf", b"123.222 497.355 Td")
+PASSWORD_ANCHOR = (b"/C2_1 11.22 Tf", b"345.005 497.356 Td")
+
+LOGIN_REPLACEMENT = (b"BT\n1 1 1 rg\n/FSP 11.22 Tf\n123.222 497.355 Td\n(", b") Tj\nET")
+PASSWORD_REPLACEMENT = (b"BT\n1 1 1 rg\n/FSP 11.22 Tf\n345.005 497.356 Td\n(", b") Tj\nET")
+
+FONT_DICT_TEMPLATE = {
+    NameObject("/Type"): NameObject("/Font"),
+    NameObject("/Subtype"): NameObject("/Type1"),
+    NameObject("/BaseFont"): NameObject("/Helvetica"),
+    NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+}
+
+PDF_ESCAPE = str.maketrans({"\\": "\\\\", "(": "\\(", ")": "\\)"})
+
+VALIDATE_FIELDS = os.environ.get("PDFS_EASY_VALIDATE_FIELDS", "") not in ("", "0")
+
+CONTENT_FLATE_LEVEL = 1
+
+FieldSpans = Tuple[Tuple[int, int], Tuple[int, int]]
+
 
 @dataclass
 class CredentialRow:
@@ -42,37 +66,70 @@ class CredentialRow:
     password: str
 
 
+def format_csv_lines(mask: pd.Series, limit: int = 20) -> str:
+    lines = (mask.index[mask] + 2).tolist()
+    text = ", ".join(str(line) for line in lines[:limit])
+    if len(lines) > limit:
+        text += f" (e mais {len(lines) - limit})"
+    return f"Linha {text}" if len(lines) == 1 else f"Linhas {text}"
+
+
 def load_rows_from_csv(
     file_buffer: io.BytesIO,
     allow_empty_credentials: bool = False,
-) -> List[CredentialRow]:
-    text_wrapper = io.TextIOWrapper(file_buffer, encoding="utf-8-sig")
-    reader = csv.DictReader(text_wrapper)
-    required = {"output_name", "login", "password"}
-    if reader.fieldnames is None or required - set(reader.fieldnames):
+) -> pd.DataFrame:
+    required = ["output_name", "login", "password"]
+    try:
+        fieldnames = list(pd.read_csv(file_buffer, nrows=0, encoding="utf-8-sig").columns)
+    except pd.errors.EmptyDataError:
+        fieldnames = None
+    if fieldnames is None or set(required) - set(fieldnames):
         raise ValueError(
             f"CSV precisa conter as colunas: {', '.join(sorted(required))}. "
-            f"Encontrado: {reader.fieldnames!r}"
+            f"Encontrado: {fieldnames!r}"
         )
 
-    rows: List[CredentialRow] = []
-    for idx, record in enumerate(reader, start=2):
-        output = (record.get("output_name") or "").strip()
-        login = (record.get("login") or "").strip()
-        password = (record.get("password") or "").strip()
-        if not output:
-            raise ValueError(f"Linha {idx}: output_name vazio.")
-        if not allow_empty_credentials and (not login or not password):
-            raise ValueError(f"Linha {idx}: login/senha vazios.")
-        rows.append(CredentialRow(output, login, password))
-
-    if not rows:
+    file_buffer.seek(0)
+    df = pd.read_csv(
+        file_buffer,
+        dtype=str,
+        usecols=required,
+        keep_default_na=False,
+        encoding="utf-8-sig",
+    )[required]
+    df = df.fillna("").apply(lambda column: column.str.strip())
+
+    problems = []
+    empty_output = df["output_name"] == ""
+    if empty_output.any():
+        problems.append(f"{format_csv_lines(empty_output)}: output_name vazio.")
+    if not allow_empty_credentials:
+        empty_credentials = (df["login"] == "") | (df["password"] == "")
+        if empty_credentials.any():
+            problems.append(f"{format_csv_lines(empty_credentials)}: login/senha vazios.")
+    if problems:
+        raise ValueError(" ".join(problems))
+
+    if df.empty:
         raise ValueError("CSV não possui registros válidos.")
-    return rows
+    return df
+
+
+def iter_credential_rows(df: pd.DataFrame) -> Iterator[CredentialRow]:
+    for output_name, login, password in df.itertuples(index=False, name=None):
+        yield CredentialRow(output_name, login, password)
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_rows_cached(csv_bytes: bytes, allow_empty_credentials: bool) -> pd.DataFrame:
+    return load_rows_from_csv(io.BytesIO(csv_bytes), allow_empty_credentials)
 
 
 def escape_pdf(text: str) -> str:
-    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return text.translate(PDF_ESCAPE)
+
+
+_font_idnums: weakref.WeakKeyDictionary[PdfWriter, int] = weakref.WeakKeyDictionary()
 
 
 def ensure_font(page, writer: PdfWriter, font_name: str = "/FSP") -> None:
@@ -94,87 +151,240 @@ def ensure_font(page, writer: PdfWriter, font_name: str = "/FSP") -> None:
     if NameObject(font_name) in fonts:
         return
 
-    font_dict = DictionaryObject(
-        {
-            NameObject("/Type"): NameObject("/Font"),
-            NameObject("/Subtype"): NameObject("/Type1"),
-            NameObject("/BaseFont"): NameObject("/Helvetica"),
-            NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
-        }
-    )
-    font_ref = writer._add_object(font_dict)
-    fonts[NameObject(font_name)] = font_ref
-
+    # Guarda apenas o idnum: um IndirectObject referencia o writer e
+    # impediria que a entrada fraca fosse descartada.
+    font_idnum = _font_idnums.get(writer)
+    if font_idnum is None:
+        font_idnum = writer._add_object(DictionaryObject(FONT_DICT_TEMPLATE)).idnum
+        _font_idnums[writer] = font_idnum
+    fonts[NameObject(font_name)] = IndirectObject(font_idnum, 0, writer)
 
-def update_page_text(page, writer: PdfWriter, login: str, password: str) -> None:
-    ensure_font(page, writer)
 
+def read_page_contents(page) -> bytes:
     contents = page.get("/Contents")
     if contents is None:
         raise RuntimeError("Página não possui conteúdo.")
 
     if isinstance(contents, ArrayObject):
-        data = b"".join(obj.get_object().get_data() for obj in contents)
-    else:
-        data = contents.get_object().get_data()
-
-    login_replacement = (
-        "BT\n"
-        "1 1 1 rg\n"
-        "/FSP 11.22 Tf\n"
-        "123.222 497.355 Td\n"
-        f"({escape_pdf(login)}) Tj\n"
-        "ET"
-    ).encode("latin1")
+        return b"".join(obj.get_object().get_data() for obj in contents)
+    return contents.get_object().get_data()
+
+
+def find_text_block(data: bytes, anchor: Tuple[bytes, bytes]) -> Tuple[int, int] | None:
+    font, position = anchor
+    pos = data.find(position)
+    while pos >= 0:
+        start = data.rfind(b"BT", 0, pos)
+        end = data.find(b"ET", pos)
+        # Entre o BT e a posição só pode haver o operador de fonte, como nas
+        # expressões regulares: nenhum ET intermediário nem outro operador.
+        operators = data[start + 2 : pos]
+        if (
+            start >= 0
+            and end >= 0
+            and data.find(b"ET", start, pos) < 0
+            and operators.strip() == font
+            and operators[-1:].isspace()
+        ):
+            return start, end + 2
+        pos = data.find(position, pos + 1)
+    return None
+
+
+def locate_credential_fields(data: bytes) -> FieldSpans:
+    login_span = find_text_block(data, LOGIN_ANCHOR)
+    password_span = find_text_block(data, PASSWORD_ANCHOR)
+    if login_span is None or password_span is None:
+        raise RuntimeError("Não foi possível localizar os campos de login/senha no PDF.")
+    if login_span[0] < password_span[1] and password_span[0] < login_span[1]:
+        raise RuntimeError(
+            "Não foi possível localizar os campos de login/senha no PDF: "
+            "login e senha estão no mesmo bloco de texto."
+        )
 
+    if VALIDATE_FIELDS:
+        login_match = LOGIN_PATTERN.search(data)
+        password_match = PASSWORD_PATTERN.search(data)
+        expected = (
+            login_match.span() if login_match else None,
+            password_match.span() if password_match else None,
+        )
+        if expected != (login_span, password_span):
+            raise RuntimeError(
+                f"Campos localizados {(login_span, password_span)!r} divergem "
+                f"das expressões regulares {expected!r}."
+            )
+    return login_span, password_span
+
+
+def splice_fields(data: bytes, replacements: Iterable[Tuple[int, int, bytes]]) -> bytes:
+    parts: List[bytes] = []
+    cursor = 0
+    for start, end, replacement in sorted(replacements):
+        parts.append(data[cursor:start])
+        parts.append(replacement)
+        cursor = end
+    parts.append(data[cursor:])
+    return b"".join(parts)
+
+
+def build_page_stream(
+    template_data: bytes,
+    fields: FieldSpans,
+    login: str,
+    password: str,
+) -> StreamObject:
+    (login_start, login_end), (password_start, password_end) = fields
+
+    login_prefix, login_suffix = LOGIN_REPLACEMENT
+    password_prefix, password_suffix = PASSWORD_REPLACEMENT
+    login_replacement = login_prefix + escape_pdf(login).encode("latin1") + login_suffix
     password_replacement = (
-        "BT\n"
-        "1 1 1 rg\n"
-        "/FSP 11.22 Tf\n"
-        "345.005 497.356 Td\n"
-        f"({escape_pdf(password)}) Tj\n"
-        "ET"
-    ).encode("latin1")
-
-    new_data, login_count = LOGIN_PATTERN.subn(login_replacement, data, count=1)
-    new_data, password_count = PASSWORD_PATTERN.subn(password_replacement, new_data, count=1)
-    if login_count == 0 or password_count == 0:
-        raise RuntimeError("Não foi possível localizar os campos de login/senha no PDF.")
+        password_prefix + escape_pdf(password).encode("latin1") + password_suffix
+    )
+
+    new_data = splice_fields(
+        template_data,
+        [
+            (login_start, login_end, login_replacement),
+            (password_start, password_end, password_replacement),
+        ],
+    )
 
     stream = DecodedStreamObject()
     stream.set_data(new_data)
-    encoded = stream.flate_encode()
-    page[NameObject("/Contents")] = writer._add_object(encoded)
+    try:
+        return stream.flate_encode(level=CONTENT_FLATE_LEVEL)
+    except TypeError:
+        # Versões do pypdf anteriores ao parâmetro ``level``.
+        return stream.flate_encode()
 
 
-def generate_pdfs(
-    template_bytes: bytes,
-    rows: Iterable[CredentialRow],
-    page_index: int,
-    keep_credentials: bool,
-) -> List[Tuple[str, bytes]]:
+def prepare_template(template_bytes: bytes, page_index: int) -> Tuple[PdfWriter, Any]:
     reader = PdfReader(io.BytesIO(template_bytes))
     if page_index < 0 or page_index >= len(reader.pages):
         raise IndexError(
             f"Página {page_index} inválida. O PDF possui {len(reader.pages)} página(s)."
         )
-    template_pages = reader.pages
 
-    outputs: List[Tuple[str, bytes]] = []
-    for cred in rows:
-        writer = PdfWriter()
-        for idx, src_page in enumerate(template_pages):
-            writer.add_page(src_page)
-            page_ref = writer.pages[-1]
-            if idx == page_index:
-                if keep_credentials:
-                    ensure_font(page_ref, writer)
-                else:
-                    update_page_text(page_ref, writer, cred.login, cred.password)
+    # O modelo é copiado para o writer uma única vez; a cada linha apenas o
+    # stream de conteúdo da página alvo é trocado antes da serialização.
+    writer = PdfWriter()
+    for src_page in reader.pages:
+        writer.add_page(src_page)
+    page_ref = writer.pages[page_index]
+    ensure_font(page_ref, writer)
+    return writer, page_ref
+
+
+def write_pdf(writer: PdfWriter) -> bytes:
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    pdf_bytes = buffer.getvalue()
+    buffer.close()
+    return pdf_bytes
+
+
+def empty_stream() -> DecodedStreamObject:
+    stream = DecodedStreamObject()
+    stream.set_data(b"")
+    return stream
+
+
+def _contents_refs(page) -> List[IndirectObject]:
+    contents = page.raw_get("/Contents")
+    refs = [contents] if isinstance(contents, IndirectObject) else []
+    contents = contents.get_object() if contents is not None else None
+    if isinstance(contents, ArrayObject):
+        refs.extend(obj for obj in contents if isinstance(obj, IndirectObject))
+    return refs
+
+
+class _BaseTemplate:
+    """Modelo serializado uma única vez, com o conteúdo da página alvo no fim.
+
+    O stream da página alvo é registrado como último objeto do PDF; assim,
+    para cada linha basta regravar esse objeto e o ``startxref``, já que os
+    deslocamentos de todos os objetos anteriores na tabela xref continuam
+    válidos.
+    """
+
+    def __init__(self, template_bytes: bytes, page_index: int) -> None:
+        writer, page_ref = prepare_template(template_bytes, page_index)
+        self.template_data = read_page_contents(page_ref)
+        self.fields = locate_credential_fields(self.template_data)
+
+        shared = {
+            ref.idnum
+            for idx, other in enumerate(writer.pages)
+            if idx != page_index
+            for ref in _contents_refs(other)
+        }
+        for ref in _contents_refs(page_ref):
+            if ref.idnum not in shared:
+                writer._replace_object(ref, empty_stream())
+
+        placeholder = empty_stream()
+        contents_ref = writer._add_object(placeholder)
+        page_ref[NameObject("/Contents")] = contents_ref
+        self.writer = writer
+        self.contents_ref = contents_ref
+
+        self.marker = b"%d 0 obj\n" % contents_ref.idnum
+        base = write_pdf(writer)
+        obj_start = base.rfind(b"\n" + self.marker) + 1
+        xref_start = base.rfind(b"\nxref\n") + 1
+        startxref = base.rfind(b"startxref\n")
+        if (
+            0 < obj_start < xref_start < startxref
+            and base[obj_start:xref_start] == self._object_bytes(placeholder)
+            and base[startxref + 10 :].split()[:1] == [b"%d" % xref_start]
+        ):
+            self.head: bytes | None = base[:obj_start]
+            self.tail = base[xref_start:startxref]
+        else:
+            # Layout de saída inesperado (outra versão do pypdf): volta a
+            # serializar o writer inteiro a cada linha.
+            self.head = None
+            self.tail = b""
+
+    def _object_bytes(self, stream: StreamObject) -> bytes:
         buffer = io.BytesIO()
-        writer.write(buffer)
-        outputs.append((cred.output_name, buffer.getvalue()))
-    return outputs
+        buffer.write(self.marker)
+        stream.write_to_stream(buffer)
+        buffer.write(b"\nendobj\n")
+        return buffer.getvalue()
+
+    def render(self, login: str, password: str) -> bytes:
+        stream = build_page_stream(self.template_data, self.fields, login, password)
+        if self.head is None:
+            self.writer._replace_object(self.contents_ref, stream)
+            return write_pdf(self.writer)
+
+        body = self._object_bytes(stream)
+        xref_location = len(self.head) + len(body)
+        return b"".join(
+            (self.head, body, self.tail, b"startxref\n%d\n%%%%EOF\n" % xref_location)
+        )
+
+
+def generate_pdfs(
+    template_bytes: bytes,
+    rows: Iterable[CredentialRow],
+    page_index: int,
+    keep_credentials: bool,
+) -> Iterator[Tuple[str, bytes]]:
+    if keep_credentials:
+        writer, _ = prepare_template(template_bytes, page_index)
+        pdf_bytes = write_pdf(writer)
+        for cred in rows:
+            yield cred.output_name, pdf_bytes
+        return
+
+    template = _BaseTemplate(template_bytes, page_index)
+
+    for cred in rows:
+        yield cred.output_name, template.render(cred.login, cred.password)
 
 
 def main() -> None:
@@ -200,26 +410,25 @@ def main() -> None:
             value=False,
             help="Ative para gerar cópias apenas com nomes diferentes.",
         )
+        compress_zip = st.checkbox(
+            "Comprimir ZIP",
+            value=False,
+            help="Os PDFs já são compactados internamente; a compressão do ZIP "
+            "reduz pouco o tamanho e torna a geração mais lenta.",
+        )
 
     uploaded_pdf = st.file_uploader("PDF modelo", type=["pdf"])
     uploaded_csv = st.file_uploader("Credenciais (CSV)", type=["csv"])
 
-    rows_preview: List[CredentialRow] | None = None
+    rows_preview: pd.DataFrame | None = None
     if uploaded_csv is not None:
         try:
-            csv_bytes = io.BytesIO(uploaded_csv.getvalue())
-            rows_preview = load_rows_from_csv(
-                csv_bytes,
+            rows_preview = load_rows_cached(
+                uploaded_csv.getvalue(),
                 allow_empty_credentials=keep_credentials,
             )
             st.success(f"{len(rows_preview)} registros carregados do CSV.")
-            st.dataframe(
-                {
-                    "output_name": [row.output_name for row in rows_preview],
-                    "login": [row.login for row in rows_preview],
-                    "password": [row.password for row in rows_preview],
-                }
-            )
+            st.dataframe(rows_preview)
         except Exception as exc:  # noqa: BLE001
             st.error(f"Erro ao ler CSV: {exc}")
 
@@ -232,28 +441,33 @@ def main() -> None:
             return
 
         if not keep_credentials:
-            for row in rows_preview:
-                if not row.login or not row.password:
-                    st.error("Login/senha vazios não são permitidos quando a opção está desativada.")
-                    return
-
+            if ((rows_preview["login"] == "") | (rows_preview["password"] == "")).any():
+                st.error("Login/senha vazios não são permitidos quando a opção está desativada.")
+                return
+
+        outputs = generate_pdfs(
+            template_bytes=uploaded_pdf.getvalue(),
+            rows=iter_credential_rows(rows_preview),
+            page_index=int(page_index),
+            keep_credentials=keep_credentials,
+        )
         try:
-            outputs = generate_pdfs(
-                template_bytes=uploaded_pdf.getvalue(),
-                rows=rows_preview,
-                page_index=int(page_index),
-                keep_credentials=keep_credentials,
-            )
+            if len(rows_preview) == 1:
+                [(filename, pdf_bytes)] = list(outputs)
+            else:
+                # Cada PDF é gravado no ZIP assim que gerado, sem manter a
+                # lista completa em memória.
+                compression = zipfile.ZIP_DEFLATED if compress_zip else zipfile.ZIP_STORED
+                zip_buffer = io.BytesIO()
+                with zipfile.ZipFile(zip_buffer, "w", compression, compresslevel=1) as zf:
+                    for filename, pdf_bytes in outputs:
+                        zf.writestr(f"{filename}.pdf", pdf_bytes)
+                zip_bytes = zip_buffer.getvalue()
         except Exception as exc:  # noqa: BLE001
             st.error(f"Erro durante a geração: {exc}")
             return
 
-        if not outputs:
-            st.warning("Nenhum PDF gerado.")
-            return
-
-        if len(outputs) == 1:
-            filename, pdf_bytes = outputs[0]
+        if len(rows_preview) == 1:
             st.download_button(
                 label=f"Baixar PDF: {filename}.pdf",
                 data=pdf_bytes,
@@ -261,13 +475,9 @@ def main() -> None:
                 mime="application/pdf",
             )
         else:
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-                for filename, pdf_bytes in outputs:
-                    zf.writestr(f"{filename}.pdf", pdf_bytes)
             st.download_button(
-                label=f"Baixar {len(outputs)} PDFs (ZIP)",
-                data=zip_buffer.getvalue(),
+                label=f"Baixar {len(rows_preview)} PDFs (ZIP)",
+                data=zip_bytes,
                 file_name="pdfs_personalizados.zip",
                 mime="application/zip",
             )